@@ -1,101 +1,51 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import pandas as pd
-import requests
-from dotenv import load_dotenv
 
-# Loads .env variables
-load_dotenv()
-
-
-# Define the Directus instance, mail and password from .env
-directus_instance = os.getenv("DIRECTUS_INSTANCE")
-directus_login = f"{directus_instance}/auth/login"
+from inat_fetcher.src.directus_client import directus_instance, get_session
 
 # Define the collection name and API url
 collection_name = "Curation_Data"
 directus_api = f"{directus_instance}/items/{collection_name}/"
-directus_email = os.getenv("DIRECTUS_EMAIL")
-directus_password = os.getenv("DIRECTUS_PASSWORD")
-
-# Create a session object for making requests
-session = requests.Session()
-
-# Send a POST request to the login endpoint
-response = session.post(directus_login, json={"email": directus_email, "password": directus_password})
-
-# Test if connection is successful
-if response.status_code == 200:
-    # Stores the access token
-    data = response.json()["data"]
-    directus_token = data["access_token"]
-
-    # Construct headers with authentication token
-    headers = {
-        "Authorization": f"Bearer {directus_token}",
-        "Content-Type": "application/json",
-    }
 
 # To obtain actual path to inat_fetcher dir
 p = Path(__file__).parents[1]
 
 # Load dataframe
-data_out_path = "/data/out/"
+data_out_path = p / "data" / "out"
 output_filename = "inat_observations_treated"
 filename_suffix = "csv"
-path_to_output_file = os.path.join(str(p) + data_out_path, output_filename + "." + filename_suffix)
-df = pd.read_csv(path_to_output_file)
+path_to_output_file = data_out_path / f"{output_filename}.{filename_suffix}"
+
+# Number of CSV rows loaded in memory at once
+chunk_size = 5000
+
+# Number of fields created at the same time
+max_workers = 16
 
 # Define the threshold for text length
 threshold = 255
 
-# Create an empty dictionary to store the biggest values of each column
-longest_content = {}
-
-# Create an empty dictionary to store the fields to create
-observation = {}
-
-# Loop over the columns to create the dict
-for col_name in df.columns:
-    # Replace dots with underscores in field names
-    new_col_name = col_name.replace(".", "_")
-    # Add to the dictionary
-    observation[new_col_name] = col_name
-
-    # Find the longest content in the column
-    longest = df[col_name].astype(str).apply(len).max()
-
-    # Store the longest content for the column
-    longest_content[new_col_name] = longest
-
-
-# Request directus to create the columns
-for i in observation:
-    col_init = str.replace(str(observation[i]), "['", "")
-    col = str.replace(col_init, "']", "")
-    col_clean = str.replace(col, ".", "_")
-    df_type = str(df[col].dtype)
-    df_col_name = str(df[col].name)
-
-    # Replace types to match directus ones
-
-    if df_type == "object" and longest_content[i] < threshold:
-        dir_type = "string"
-    elif df_type == "int64" and longest_content[i] < threshold:
-        dir_type = "integer"
-    elif df_type == "bool" and longest_content[i] < threshold:
-        dir_type = "boolean"
-    elif df_type == "float64" and longest_content[i] < threshold:
-        dir_type = "float"
-    elif longest_content[i] >= threshold:
-        dir_type = "text"
-    else:
-        # If type is not handled by the ones already made, print it so we can integrate it easily
-        print(f"not handled type: {type}")
-    if df_col_name == "geojson.coordinates":
-        dir_type = "geometry.Point"
+# Directus type of each pandas type, pandas types holding text, and columns holding coordinates
+type_map = {"object": "string", "string": "string", "int64": "integer", "bool": "boolean", "float64": "float"}
+text_types = {"object", "string"}
+geo_columns = {"geojson.coordinates"}
+
+
+def merge_dtypes(first: str, second: str) -> str:
+    """Returns the type pandas would have inferred for a column read at once, given the types of two of its chunks."""
+    if first == second:
+        return first
+    if {first, second} == {"int64", "float64"}:
+        return "float64"
+    return "object"
+
 
+def create_field(col_clean: str, dir_type: str, exists: bool) -> None:
+    """Creates a field in the directus collection, or updates its type if it already exists with another one."""
+    session = get_session()
     # Create patch url
     url_patch = f"{directus_instance}/fields/{collection_name}/{col_clean}"
 
@@ -104,29 +54,101 @@ for i in observation:
     # Create a field for each csv column
     data = {"field": col_clean, "type": dir_type}
 
+    # Update the type of existing fields
+    if exists:
+        response = session.patch(url_patch, json=data, timeout=10)
+        if response.status_code == 200:
+            print(f"field {col_clean} updated")
+            print(dir_type)
+        else:
+            print(f"error updating field {col_clean}")
+        return
+
     # Make directus request
-    response = requests.post(url, json=data, headers=headers, timeout=10)
+    response = session.post(url, json=data, timeout=10)
     # Check if adding is success
     if response.status_code == 200:
         print(f"{col_clean} field created")
         # If field is of type geometry.Point, add a validation to correctly display map
         if dir_type == "geometry.Point":
             validation = {"meta": {"validation": {"_and": [{col_clean: {"_intersects_bbox": None}}]}}}
-            response = requests.patch(url_patch, json=validation, headers=headers, timeout=10)
+            response = session.patch(url_patch, json=validation, timeout=10)
             if response.status_code == 200:
                 print(f"validation correctly added for field {col_clean}")
             else:
                 print("error adding validation")
     # else print the type and the column name
-    elif response.status_code == 400:
-        response = requests.patch(url_patch, json=data, headers=headers, timeout=10)
-        if response.status_code == 200:
-            print(f"field {col_clean} updated")
-            print(dir_type)
-        else:
-            print(f"error creating/updating field {col_clean}")
     else:
         print(response.status_code)
         print(response.text)
         print(dir_type)
         print(col_clean)
+
+
+def scan_columns(chunks: Iterable[pd.DataFrame]) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """Returns the type and the length of the longest content of each column, across all the chunks of a table."""
+    # Create empty dictionaries to store the type and the biggest value of each column
+    dtypes: Dict[str, str] = {}
+    longest_content: Dict[str, int] = {}
+
+    for chunk in chunks:
+        for col_name in chunk.columns:
+            # Keep a type compatible with every chunk
+            chunk_type = str(chunk[col_name].dtype)
+            dtypes[col_name] = merge_dtypes(dtypes.get(col_name, chunk_type), chunk_type)
+
+            # Find the longest content in the column and keep the biggest one across chunks. Numbers and booleans
+            # can never reach the threshold, so only text columns are measured.
+            longest = chunk[col_name].astype(str).str.len().max() if chunk_type in text_types else 0
+            longest_content[col_name] = max(longest_content.get(col_name, 0), longest)
+
+    return dtypes, longest_content
+
+
+def run(df: Optional[pd.DataFrame] = None) -> None:
+    """Creates or updates a directus field for each column of the treated observations, read from CSV if not given."""
+    # Load the dataframe chunk by chunk, so that only one chunk is held in memory. A given DataFrame already is.
+    chunks: Iterable[pd.DataFrame] = [df] if df is not None else pd.read_csv(path_to_output_file, chunksize=chunk_size)
+    dtypes, longest_content = scan_columns(chunks)
+
+    # Replace dots with underscores in field names, once per column
+    field_names = {col_name: col_name.replace(".", "_") for col_name in dtypes}
+
+    # Fetch the fields already present in the collection with their type, so that only missing or changed fields are sent
+    session = get_session()
+    response = session.get(f"{directus_instance}/fields/{collection_name}", timeout=10)
+    existing_fields = {field["field"]: field["type"] for field in response.json()["data"]}
+
+    # List the fields to create or update with their directus type
+    fields_to_create: List[Tuple[str, str]] = []
+    for col, col_clean in field_names.items():
+        df_type = dtypes[col]
+
+        # Replace types to match directus ones
+        if col in geo_columns:
+            dir_type = "geometry.Point"
+        elif longest_content[col] >= threshold:
+            dir_type = "text"
+        elif df_type in type_map:
+            dir_type = type_map[df_type]
+        else:
+            # If type is not handled by the ones already made, print it so we can integrate it easily
+            print(f"not handled type: {df_type}, {col_clean} created as string")
+            dir_type = "string"
+
+        if existing_fields.get(col_clean) != dir_type:
+            fields_to_create.append((col_clean, dir_type))
+
+    # Create the fields concurrently over the same session
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(create_field, col_clean, dir_type, col_clean in existing_fields)
+            for col_clean, dir_type in fields_to_create
+        ]
+        # Wait for the fields, raising any error that occurred in a worker
+        for future in futures:
+            future.result()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,86 +1,138 @@
-import math
-import os
 import typing
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
 
+import orjson
 import pandas as pd
-import requests
-from dotenv import load_dotenv
 
-# Loads .env variables
-load_dotenv()
-
-# Define the Directus instance, mail and password from .env
-directus_instance = os.getenv("DIRECTUS_INSTANCE")
-directus_login = f"{directus_instance}/auth/login"
+from inat_fetcher.src.directus_client import directus_instance, fetch_items, get_session
 
 # Define the collection name and API url
 collection_name = "Curation_Data"
 directus_api = f"{directus_instance}/items/{collection_name}/"
-directus_email = os.getenv("DIRECTUS_EMAIL")
-directus_password = os.getenv("DIRECTUS_PASSWORD")
 
 # To obtain actual path to inat_fetcher dir
 p = Path(__file__).parents[1]
 
 # Load dataframe
-data_out_path = "/data/out/"
+data_out_path = p / "data" / "out"
 output_filename = "inat_observations_treated"
 filename_suffix = "csv"
-path_to_output_file = os.path.join(str(p) + data_out_path, output_filename + "." + filename_suffix)
-df = pd.read_csv(path_to_output_file)
-
-# Create a session object for making requests
-session = requests.Session()
-
-# Send a POST request to the login endpoint
-response = session.post(directus_login, json={"email": directus_email, "password": directus_password})
+path_to_output_file = data_out_path / f"{output_filename}.{filename_suffix}"
+
+# Number of CSV rows loaded in memory at once
+chunk_size = 5000
+
+# Types of the known columns, declared so that pandas does not have to infer them. Dates are kept as strings
+# since they are sent to directus as such.
+dtypes = {
+    "id": "int64",
+    "uuid": "string",
+    "emi_external_id": "string",
+    "geojson.coordinates": "string",
+    "tags": "string",
+    "quality_grade": "string",
+    "license_code": "string",
+    "taxon.rank": "string",
+    "observed_on": "string",
+    "time_observed_at": "string",
+    "created_at": "string",
+    "updated_at": "string",
+}
 
 geo_prefix = '"type":"Point","coordinates":'
 
-# Test if connection is successful
-if response.status_code == 200:
-    # Stores the access token
-    data = response.json()["data"]
-    directus_token = data["access_token"]
-
-    # Construct headers with authentication token
-    headers = {"Authorization": f"Bearer {directus_token}", "Content-Type": "application/json"}
-
-    # Create an empty dictionary to store the fields to create
-    observation: Dict[str, typing.Any] = {}
-
-    # Format each observation for directus
-    for col_name in df.columns:
-        # Replace dots with underscores in field names
-        new_col_name = col_name.replace(".", "_")
-        # Add to the dictionary
-        observation[new_col_name] = None  # Initialize with None
-
-    # Iterate over each row in the DataFrame
-    for i in range(len(df)):
-        # Convert each row to a dictionary
-        obs = df.iloc[i].to_dict()
-
-        # Convert problematic float values
-        for key, value in obs.items():
-            if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
-                obs[key] = None if math.isnan(value) else str(value)
-
-        # Update the observation dictionary with values from the current row
-        for col_name, value in obs.items():
-            if col_name == "geojson.coordinates" and value:
-                observation[col_name.replace(".", "_")] = "{" + geo_prefix + value + "}"
-            else:
-                observation[col_name.replace(".", "_")] = value
-
-        # Send the POST request to create or update the fields
-        response = session.post(url=directus_api, headers=headers, json=observation)
-        # Check if the request was successful
-        if response.status_code != 200:
-            directus_observation = f"{directus_api}{obs['id']}"
-            response2 = session.patch(url=directus_observation, headers=headers, json=observation)
-            if response2.status_code != 200:
-                print(f"Error: {response2.status_code} - {response2.text}")
-                print(obs["emi_external_id"])
+# Number of observations sent in a single request, and number of requests sent at the same time
+batch_size = 200
+max_workers = 8
+
+
+def upload_observation(method: str, observation: Dict[str, typing.Any]) -> None:
+    """Creates (POST) or updates (PATCH) a single observation in directus."""
+    session = get_session()
+    # Known observations are updated through their own url
+    url = directus_api if method == "POST" else f"{directus_api}{observation['id']}"
+    payload = orjson.dumps(observation, option=orjson.OPT_SERIALIZE_NUMPY)
+    response = session.request(method, url, data=payload, timeout=60)
+    # Check if the request was successful
+    if response.status_code != 200:
+        print(f"Error: {response.status_code} - {response.text}")
+        print(observation["emi_external_id"])
+
+
+def upload(method: str, batch: List[Dict[str, typing.Any]]) -> None:
+    """Creates (POST) or updates (PATCH) a batch of observations in a single directus request.
+
+    Directus rejects a whole batch when one of its observations is invalid, so the observations of a rejected batch
+    are sent again one by one and only the invalid ones are lost.
+    """
+    session = get_session()
+    payload = orjson.dumps(batch, option=orjson.OPT_SERIALIZE_NUMPY)
+    response = session.request(method, directus_api, data=payload, timeout=60)
+    # Check if the request was successful, else find the observations directus rejects
+    if response.status_code != 200:
+        print(f"batch of {len(batch)} observations rejected ({response.status_code}), sending them one by one")
+        for observation in batch:
+            upload_observation(method, observation)
+
+
+def format_observations(df: pd.DataFrame) -> List[Dict[str, typing.Any]]:
+    """Converts the rows of a DataFrame to observations ready to be sent to directus."""
+    # Format the coordinates as a geojson point on the whole column, missing coordinates stay missing
+    if "geojson.coordinates" in df.columns:
+        df["geojson.coordinates"] = "{" + geo_prefix + df["geojson.coordinates"].astype("string") + "}"
+
+    # Replace missing values by None in a single pass, infinite values are serialized as null by orjson
+    df = df.astype(object).where(df.notna(), None)
+
+    # Replace dots with underscores in field names and convert the whole DataFrame to dictionaries at once
+    col_map = {col_name: col_name.replace(".", "_") for col_name in df.columns}
+    return typing.cast(List[Dict[str, typing.Any]], df.rename(columns=col_map).to_dict(orient="records"))
+
+
+def read_chunks(df: Optional[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Yields the treated observations chunk by chunk, from the given DataFrame or else from the treated CSV."""
+    if df is None:
+        yield from pd.read_csv(path_to_output_file, chunksize=chunk_size, dtype=dtypes, engine="c")
+        return
+
+    # Give the DataFrame the types the CSV would have been read with
+    df = df.astype({col_name: dtype for col_name, dtype in dtypes.items() if col_name in df.columns})
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size].copy()
+
+
+def run(df: Optional[pd.DataFrame] = None) -> None:
+    """Creates or updates the treated observations in directus, read from the treated CSV when not given."""
+    # Fetch the ids already stored in directus, so that each observation is sent to the right endpoint
+    existing_ids = {str(item["id"]) for item in fetch_items(collection_name, fields=["id"])}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: List[Future[None]] = []
+        # Load the observations chunk by chunk, so that a chunk is uploaded while the next one is prepared
+        for chunk in read_chunks(df):
+            observations = format_observations(chunk)
+            new_observations = [
+                observation for observation in observations if str(observation["id"]) not in existing_ids
+            ]
+            known_observations = [observation for observation in observations if str(observation["id"]) in existing_ids]
+
+            # Upload the observations concurrently in batches, new ones are created and known ones are updated
+            submitted = [
+                executor.submit(upload, method, group[start : start + batch_size])
+                for method, group in (("POST", new_observations), ("PATCH", known_observations))
+                for start in range(0, len(group), batch_size)
+            ]
+
+            # Wait for the previous chunk, raising any error that occurred in a worker, to hold at most two chunks in memory
+            for future in pending:
+                future.result()
+            pending = submitted
+
+        for future in pending:
+            future.result()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,154 @@
+import functools
+import math
+import os
+import tempfile
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import orjson
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Loads .env variables
+load_dotenv()
+
+# Define the Directus instance, mail and password from .env
+directus_instance = os.getenv("DIRECTUS_INSTANCE")
+directus_login = f"{directus_instance}/auth/login"
+directus_email = os.getenv("DIRECTUS_EMAIL")
+directus_password = os.getenv("DIRECTUS_PASSWORD")
+
+# File where the access token is kept between scripts, and number of seconds a cached token must still be valid for
+token_cache_file = Path.home() / ".cache" / "inat_fetcher" / "directus_token.json"
+token_margin = 60
+
+# Lock making concurrent workers that are refused their token log in again only once
+token_lock = threading.Lock()
+
+# Number of items fetched in a single request, and number of pages fetched at the same time
+page_size = 1000
+max_workers = 8
+
+
+@functools.lru_cache(maxsize=1)
+def get_session() -> requests.Session:
+    """Logs in to directus once and returns a session sending the access token with every request.
+
+    The session keeps connections alive for concurrent workers and retries throttled or temporarily failing
+    requests with an exponential backoff.
+    """
+    session = requests.Session()
+    # Only the statuses telling that directus did not process the request are retried, and never a read timeout,
+    # as a bulk POST which reached directus would otherwise create its items twice
+    retries = Retry(
+        total=5,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=[429, 503],
+        allowed_methods=["GET", "POST", "PATCH"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    directus_token = get_directus_token(session)
+
+    # Attach headers with authentication token to the session so that every request reuses them
+    session.headers.update({"Authorization": f"Bearer {directus_token}", "Content-Type": "application/json"})
+    session.hooks["response"].append(functools.partial(reauthenticate, session))
+    return session
+
+
+def reauthenticate(session: requests.Session, response: requests.Response, **kwargs: typing.Any) -> requests.Response:
+    """Logs in again and resends a request once when directus refuses its token, raising if it is refused again."""
+    if response.status_code != 401 or response.request.url == directus_login:
+        return response
+
+    # Consume and close the refused response so that its connection goes back to the pool
+    _ = response.content
+    response.close()
+
+    # Log in again unless another worker already did it since this request was sent
+    refused_authorization = response.request.headers.get("Authorization")
+    with token_lock:
+        if session.headers.get("Authorization") == refused_authorization:
+            session.headers["Authorization"] = f"Bearer {get_directus_token(session, use_cache=False)}"
+
+    # Resend the request with the new token, without this hook so that a second refusal is not retried
+    retry_request = response.request.copy()
+    retry_request.headers["Authorization"] = str(session.headers["Authorization"])
+    retry_request.hooks = {"response": []}
+    retry_response = session.send(retry_request, **kwargs)
+    if retry_response.status_code == 401:
+        retry_response.raise_for_status()
+    return retry_response
+
+
+def get_directus_token(session: requests.Session, use_cache: bool = True) -> str:
+    """Returns a directus access token, reusing the one cached by a previous script while it is still valid."""
+    try:
+        cached = orjson.loads(token_cache_file.read_bytes()) if use_cache else {}
+    except (OSError, ValueError):
+        cached = {}
+    if (
+        cached.get("instance") == directus_instance
+        and cached.get("email") == directus_email
+        and cached.get("expires_at", 0) > time.time() + token_margin
+    ):
+        return str(cached["access_token"])
+
+    # Send a POST request to the login endpoint without any previous token, stopping here if it is not successful
+    response = session.post(
+        directus_login,
+        json={"email": directus_email, "password": directus_password},
+        headers={"Authorization": None},
+        timeout=10,
+    )
+    response.raise_for_status()
+    data = response.json()["data"]
+
+    # Replace the cached token atomically in a file only readable by the user, the cache being optional
+    token = {
+        "instance": directus_instance,
+        "email": directus_email,
+        "access_token": data["access_token"],
+        "expires_at": time.time() + data["expires"] / 1000,
+    }
+    try:
+        token_cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=token_cache_file.parent)
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(orjson.dumps(token))
+        os.replace(tmp_path, token_cache_file)
+    except OSError as error:
+        print(f"couldn't cache the directus token: {error}")
+    return str(data["access_token"])
+
+
+def fetch_items(collection_name: str, fields: Optional[List[str]] = None) -> List[Dict[str, typing.Any]]:
+    """Fetches all the items of a directus collection, one page per request with pages fetched concurrently."""
+    session = get_session()
+    url = f"{directus_instance}/items/{collection_name}"
+    params: Dict[str, typing.Any] = {"fields": ",".join(fields)} if fields else {}
+
+    # Ask for the number of items first, to know how many pages to request
+    response = session.get(url, params={**params, "limit": 1, "meta": "total_count"}, timeout=60)
+    response.raise_for_status()
+    total_count = response.json()["meta"]["total_count"]
+
+    def fetch_page(page: int) -> List[Dict[str, typing.Any]]:
+        response = session.get(url, params={**params, "limit": page_size, "page": page}, timeout=60)
+        response.raise_for_status()
+        return typing.cast(List[Dict[str, typing.Any]], response.json()["data"])
+
+    # Pages are numbered from 1 and returned in order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(fetch_page, range(1, math.ceil(total_count / page_size) + 1))
+        return [item for page in pages for item in page]
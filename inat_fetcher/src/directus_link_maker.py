@@ -1,62 +1,120 @@
-import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 
+import orjson
 import requests
-from dotenv import load_dotenv
 
-# Loads .env variables
-load_dotenv()
-
-# Define the Directus instance, mail and password from .env
-directus_instance = os.getenv("DIRECTUS_INSTANCE")
-directus_login = f"{directus_instance}/auth/login"
+from inat_fetcher.src.directus_client import directus_instance, fetch_items, get_session
 
 # Define the collection name and API url
 collection_name = "Inat_Data"
-directus_api = f"{directus_instance}/items/{collection_name}/"
-directus_email = os.getenv("DIRECTUS_EMAIL")
-directus_password = os.getenv("DIRECTUS_PASSWORD")
-
-# Create a session object for making requests
-session = requests.Session()
-
-# Send a POST request to the login endpoint
-response = session.post(directus_login, json={"email": directus_email, "password": directus_password})
-
-# Test if connection is successful
-if response.status_code == 200:
-    # Stores the access token
-    data = response.json()["data"]
-    directus_token = data["access_token"]
-
-    # Construct headers with authentication token
-    headers = {"Authorization": f"Bearer {directus_token}", "Content-Type": "application/json"}
-
-    # Send the get request to create or update the fields
-    response = session.get(url=f"{directus_api}?limit=-1", headers=headers)
-    data = response.json()["data"]
-    item_id = [item["id"] for item in data]
-    emi_id = [item["emi_external_id"] for item in data]
-    for i in range(len(item_id)):
-        if emi_id[i]:
-            directus_patch = f"{directus_instance}/items/Field_Samples/" + emi_id[i]
-            inaturalist_link = "https://www.inaturalist.org/observations/" + item_id[i]
-            observation = {"inat_observation_id": item_id[i], "inaturalist_link": inaturalist_link}
-            response = session.patch(url=directus_patch, headers=headers, json=observation)
-            if response.status_code != 200:
-                print(f"error, couldn't make the link between {item_id[i]} and {emi_id[i]}")
-                print(response.status_code)
-                print(response.text)
-
-    # Send get request to check if data has been added to directus. If not, set inat_observation_id and inaturalist_link to absent
-    directus_api2 = f"{directus_instance}/items/Qfield_Data/"
-    response2 = session.get(url=f"{directus_api2}?limit=-1", headers=headers)
-    data2 = response2.json()["data"]
-    item_id2 = [item["field_sample_name"] for item in data2]
-    emi_id2 = [item["field_sample_id_pk"] for item in data2]
-    for i in range(len(item_id2)):
-        if item_id2[i] == "Mixte":
-            print(item_id2[i])
-            print(emi_id2[i])
-            directus_patch2 = f"{directus_instance}/items/Field_Samples/" + emi_id2[i]
-            observation2 = {"inat_observation_id": "absent", "inaturalist_link": "absent"}
-            response2 = session.patch(url=directus_patch2, headers=headers, json=observation2)
+field_samples_api = f"{directus_instance}/items/Field_Samples"
+
+# Number of links sent in a single request, and number of requests sent at the same time
+batch_size = 500
+max_workers = 8
+
+
+class MissingPrimaryKeyError(Exception):
+    """Raised when directus reports no primary key among the fields of a collection."""
+
+    def __init__(self, collection: str) -> None:
+        super().__init__(f"no primary key found in the fields of {collection}")
+
+
+def update_field_samples(updates: typing.Union[List[Dict[str, str]], Dict[str, typing.Any]]) -> bool:
+    """Sends a bulk update of field samples in a single directus request, returning whether it succeeded."""
+    session = get_session()
+    # A failing batch is reported without interrupting the other ones
+    try:
+        response = session.patch(url=field_samples_api, data=orjson.dumps(updates), timeout=60)
+    except requests.RequestException as error:
+        print(f"error, couldn't update field samples: {error}")
+        return False
+    if response.status_code != 200:
+        print("error, couldn't update field samples")
+        print(response.status_code)
+        print(response.text)
+        return False
+    return True
+
+
+def link_field_samples(links: List[Dict[str, str]], primary_key: str) -> List[str]:
+    """Links a batch of field samples in a single request, else one by one, returning the ones left unlinked."""
+    if update_field_samples(links):
+        return []
+    # Directus rejects a whole batch when one of its links is invalid, so the links are sent again one by one
+    return [link[primary_key] for link in links if not update_field_samples([link])]
+
+
+def run() -> None:
+    """Links the field samples to their iNaturalist observations in directus."""
+    # Find the primary key of the field samples, which identifies each sample in a bulk update
+    session = get_session()
+    response = session.get(f"{directus_instance}/fields/Field_Samples", timeout=10)
+    response.raise_for_status()
+    primary_key = next(
+        (field["field"] for field in response.json()["data"] if (field["schema"] or {}).get("is_primary_key")), None
+    )
+    if primary_key is None:
+        raise MissingPrimaryKeyError("Field_Samples")
+
+    # Send the get request to obtain the observations, with only the fields needed to make the links
+    data = fetch_items(collection_name, fields=["id", "emi_external_id"])
+
+    # Fetch the current link of each field sample, so that only missing or outdated links are sent
+    samples = fetch_items("Field_Samples", fields=[primary_key, "inat_observation_id"])
+    current_links = {sample[primary_key]: str(sample["inat_observation_id"]) for sample in samples}
+
+    # Find the mixed samples, which are always marked as absent even if an observation is tagged with their id
+    qfield_data = fetch_items("Qfield_Data", fields=["field_sample_name", "field_sample_id_pk"])
+    mixed_ids = {item["field_sample_id_pk"] for item in qfield_data if item["field_sample_name"] == "Mixte"}
+
+    # Link each other field sample to its iNaturalist observation
+    links: List[Dict[str, str]] = [
+        {
+            primary_key: item["emi_external_id"],
+            "inat_observation_id": item["id"],
+            "inaturalist_link": f"https://www.inaturalist.org/observations/{item['id']}",
+        }
+        for item in data
+        if item["emi_external_id"] in current_links
+        and item["emi_external_id"] not in mixed_ids
+        and current_links[item["emi_external_id"]] != str(item["id"])
+    ]
+    unknown_samples = [
+        item["emi_external_id"]
+        for item in data
+        if item["emi_external_id"] and item["emi_external_id"] not in current_links
+    ]
+    if unknown_samples:
+        print(f"no field sample found for {len(unknown_samples)} observations: {unknown_samples}")
+
+    # Make the links in batches, sent concurrently over the same session
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(link_field_samples, links[start : start + batch_size], primary_key)
+            for start in range(0, len(links), batch_size)
+        ]
+        # Wait for all the batches and gather the field samples that could not be linked
+        unlinked_samples = [sample_id for future in futures for sample_id in future.result()]
+
+    if unlinked_samples:
+        print(f"{len(unlinked_samples)} field samples could not be linked: {unlinked_samples}")
+
+    # Set inat_observation_id and inaturalist_link to absent for the mixed samples not marked yet. Mixed samples missing
+    # from the field samples are left out, as directus would reject the whole update for them.
+    absent_ids = sorted(
+        sample_id for sample_id in mixed_ids if sample_id in current_links and current_links[sample_id] != "absent"
+    )
+    if absent_ids:
+        print(f"{len(absent_ids)} Mixte samples marked absent")
+        update_field_samples({
+            "keys": absent_ids,
+            "data": {"inat_observation_id": "absent", "inaturalist_link": "absent"},
+        })
+
+
+if __name__ == "__main__":
+    run()
@@ -1,63 +1,79 @@
-import os
+import re
 from pathlib import Path
+from typing import Tuple
 
 import pandas as pd
-import requests
-from dotenv import load_dotenv
 
-load_dotenv()
+from inat_fetcher.src.directus_client import directus_instance, get_session
 
 # To obtain actual path to inat_fetcher dir
 p = Path(__file__).parents[1]
 
 # Set up paths and filenames
-data_in_path = "/data/in/"
-data_out_path = "/data/out/"
+data_in_path = p / "data" / "in"
+data_out_path = p / "data" / "out"
 input_filename = "inat_observations_raw"
 output_filename = "inat_observations_treated"
 recovery_filename = "inat_observation_recovery"
-filename_suffix = ".csv"
-path_to_input_file = os.path.join(str(p) + data_in_path, input_filename + filename_suffix)
-path_to_output_file = os.path.join(str(p) + data_out_path, output_filename + filename_suffix)
-path_to_recovery_file = os.path.join(str(p) + data_out_path, recovery_filename + filename_suffix)
-
-# Request to directus to obtain projects codes
-url = os.getenv("DIRECTUS_INSTANCE")
-collection_url = f"{url}/items/Projects"
+filename_suffix = "csv"
+path_to_input_file = data_in_path / f"{input_filename}.{filename_suffix}"
+path_to_output_file = data_out_path / f"{output_filename}.{filename_suffix}"
+path_to_recovery_file = data_out_path / f"{recovery_filename}.{filename_suffix}"
+
+# Directus collection holding the projects codes
+collection_url = f"{directus_instance}/items/Projects"
 column = "project_id"
 params = {"sort[]": f"{column}"}
-session = requests.Session()
-response = session.get(collection_url, params=params)
-data = response.json()["data"]
-project_names = [item[column] for item in data]
 
-# Aggregate patterns
-pattern = "(" + "|".join(project_names) + ")_[0-9]{6}"
-pattern_all = "(" + "|".join(project_names) + ")_[0-9]{6}|dbgi_spl_[0-9]{6}"
 
-# Load dataframe
-df = pd.read_csv(path_to_input_file)
+def extract_emi_external_ids(df: pd.DataFrame) -> "pd.Series[str]":
+    """Returns the emi external id of each observation, from its tag if it has one, else from its field value."""
+    # Extract the emi_external_id of each line with column-wise string operations. The tag is used when there is one,
+    # else the observation field value, else 'NA'.
+    has_tags = df["tags"] != "[]"
+    tag_ids = df["tags"].str[2:-2].str.replace("emi_external_id:", "", regex=False)
+    ofvs_ids = df["ofvs.15466"].astype(str).where(df["ofvs.15466"].notna(), "NA")
+    return tag_ids.where(has_tags, ofvs_ids).astype("string")
+
+
+def split_observations(df: pd.DataFrame, pattern: re.Pattern[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits the observations between the ones whose emi external id matches the pattern and the other ones."""
+    # Split dataframe based on emi_external_id column matching the pattern, matching the column only once
+    matches_pattern = df["emi_external_id"].str.match(pattern)
+    pattern_matched_df = df[matches_pattern].copy()
+    pattern_matched_df["emi_external_id"] = pattern_matched_df["emi_external_id"].replace(
+        r"dbgi_spl_", "dbgi_", regex=True
+    )
+    return pattern_matched_df, df[~matches_pattern]
+
+
+def run() -> pd.DataFrame:
+    """Extracts the emi external id of each observation, writes the treated and recovery CSVs and returns the treated."""
+    # Request to directus to obtain projects codes
+    session = get_session()
+    response = session.get(collection_url, params=params)
+    data = response.json()["data"]
+    project_names = [item[column] for item in data]
+
+    # Aggregate the pattern of all the projects
+    pattern_all = re.compile("(" + "|".join(project_names) + ")_[0-9]{6}|dbgi_spl_[0-9]{6}")
+
+    # Load dataframe
+    df = pd.read_csv(path_to_input_file)
 
-# Create a new column with all values initialized to 'NA'
-df["emi_external_id"] = "NA"
+    df["emi_external_id"] = extract_emi_external_ids(df)
+    pattern_matched_df, pattern_unmatched_df = split_observations(df, pattern_all)
 
-# loop over each line
-for i in range(len(df)):
-    # if the 'tags' line is not empty
-    if df.tags[i] != "[]":
-        cleaned_string = str.replace(df.tags[i][2:-2], "emi_external_id:", "")
-        df.loc[i, "emi_external_id"] = cleaned_string
-    elif df["ofvs.15466"][i] != "":
-        df.loc[i, "emi_external_id"] = str(df["ofvs.15466"][i])
+    # We keep the tables
+    pattern_matched_df.to_csv(path_to_output_file, index=False)
+    pattern_unmatched_df.to_csv(path_to_recovery_file, index=False)
 
-# Split dataframe based on emi_external_id column matching the pattern
+    print("csv correctly updated")
 
-pattern_matched_df = df[df["emi_external_id"].str.match(str(pattern_all))]
-pattern_matched_df["emi_external_id"] = pattern_matched_df["emi_external_id"].replace(r"dbgi_spl_", "dbgi_", regex=True)
-pattern_unmatched_df = df[~df["emi_external_id"].str.match(str(pattern_all))]
+    # Hand over the treated observations with the types they have in the treated CSV. The types inferred from the raw
+    # CSV also account for the unmatched observations, so they can differ.
+    return pd.read_csv(path_to_output_file)
 
-# We keep the tables
-pattern_matched_df.to_csv(path_to_output_file, index=False)
-pattern_unmatched_df.to_csv(path_to_recovery_file, index=False)
 
-print("csv correctly updated")
+if __name__ == "__main__":
+    run()
@@ -1,5 +1,8 @@
 import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Set
 
 import pandas as pd
 from dotenv import load_dotenv
@@ -12,58 +15,61 @@ load_dotenv()
 p = Path(__file__).parents[1]
 
 # Set up paths and filenames
-data_in_path = "/data/in/"
+data_in_path = p / "data" / "in"
 output_filename = "inat_observations_raw"
 filename_suffix = "csv"
-path_to_output_file = os.path.join(str(p) + data_in_path, output_filename + "." + filename_suffix)
+path_to_output_file = data_in_path / f"{output_filename}.{filename_suffix}"
 
 # import env variable
 access_token = os.getenv("INATURALIST_ACCESS_TOKEN")
 
-# Fetch values from iNaturalist for the different users
-response_project = get_observations(project_id=130644, page="all", per_page=200, access_token=access_token)
-df_project = to_dataframe(response_project)
+# Observations to fetch: the project ones and the ones of the different users
+queries: List[Dict[str, typing.Any]] = [
+    {"project_id": 130644},
+    {"user_id": "dbgi"},
+    {"user_id": "edouardbruelhart"},
+    {"user_id": "edouard-brulhart"},
+    {"user_id": "manu_dfz"},
+    {"user_id": "lenditaschwegler"},
+    {"user_id": "guetchuengst"},
+]
 
-response_dbgi = get_observations(user_id="dbgi", page="all", per_page=200, access_token=access_token)
-df_dbgi = to_dataframe(response_dbgi)
 
-response_edouardbruelhart = get_observations(
-    user_id="edouardbruelhart", page="all", per_page=200, access_token=access_token
-)
-df_edouardbruelhart = to_dataframe(response_edouardbruelhart)
+def fetch_observations(query: Dict[str, typing.Any]) -> pd.DataFrame:
+    """Fetches all the pages of observations matching a query from iNaturalist."""
+    response = get_observations(**query, page="all", per_page=200, access_token=access_token)
+    return typing.cast(pd.DataFrame, to_dataframe(response))
 
-response_edouardbrulhart = get_observations(
-    user_id="edouard-brulhart", page="all", per_page=200, access_token=access_token
-)
-df_edouardbrulhart = to_dataframe(response_edouardbrulhart)
 
-response_manu_dfz = get_observations(user_id="manu_dfz", page="all", per_page=200, access_token=access_token)
-df_manu_dfz = to_dataframe(response_manu_dfz)
+def run() -> None:
+    """Fetches the observations from iNaturalist and writes them to the raw CSV."""
+    # Fetch values from iNaturalist for the different users at the same time. pyinaturalist shares its rate limit
+    # between threads, so the concurrent queries still respect the iNaturalist API limits.
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        dataframes = list(executor.map(fetch_observations, queries))
 
-response_lenditaschwegler = get_observations(
-    user_id="lenditaschwegler", page="all", per_page=200, access_token=access_token
-)
-df_lenditaschwegler = to_dataframe(response_lenditaschwegler)
+    # Merge iNaturalist data, keeping only the first occurrence of each observation as the frames are added
+    seen_ids: Set[int] = set()
+    new_observations = []
+    for user_df in dataframes:
+        if user_df.empty:
+            continue
+        is_new = ~user_df["id"].isin(seen_ids) & ~user_df["id"].duplicated()
+        new_observations.append(user_df[is_new])
+        seen_ids.update(user_df["id"][is_new])
+    df = pd.concat(new_observations, ignore_index=True)
 
-response_guetchuengst = get_observations(user_id="guetchuengst", page="all", per_page=200, access_token=access_token)
-df_guetchuengst = to_dataframe(response_guetchuengst)
+    # shift column 'id' to first position
+    first_column = df.pop("id")
 
-# Merge iNaturalist data
-df = pd.concat(
-    [df_project, df_dbgi, df_edouardbruelhart, df_edouardbrulhart, df_manu_dfz, df_lenditaschwegler, df_guetchuengst],
-    ignore_index=True,
-)
+    # insert column using insert(position,column_name,
+    df.insert(0, "id", first_column)
 
-# shift column 'id' to first position
-first_column = df.pop("id")
+    # Write the table as CSV
+    df.to_csv(path_to_output_file, index=False)
 
-# insert column using insert(position,column_name,
-df.insert(0, "id", first_column)
+    print("csv correctly written")
 
-# Drop duplicates
-df = df.drop_duplicates(subset=["id"])
 
-# Write the table as CSV
-df.to_csv(path_to_output_file, index=False)
-
-print("csv correctly written")
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,39 @@
+import typing
+from pathlib import Path
+from types import ModuleType
+
+from inat_fetcher.src import create_directus_fields, db_updater, directus_link_maker, emi_id_extracter, fetcher
+
+# To obtain actual path to inat_fetcher dir
+p = Path(__file__).parents[1]
+
+
+def run_script(script: ModuleType, *args: typing.Any) -> typing.Any:
+    """Runs a script of the pipeline, reporting which one failed if it raises."""
+    script_name = script.__name__.rsplit(".", 1)[-1]
+    print(f"Running {script_name}")
+    try:
+        return script.run(*args)
+    except Exception:
+        print(f"{script_name} failed")
+        raise
+
+
+def main() -> None:
+    """Runs the scripts of the pipeline one after the other in a single process, sharing the directus session."""
+    # Create necessary directories if they don't exist
+    (p / "data" / "in").mkdir(parents=True, exist_ok=True)
+    (p / "data" / "out").mkdir(parents=True, exist_ok=True)
+
+    run_script(fetcher)
+
+    # The treated CSV is parsed once, and the next scripts receive the observations in memory instead of each parsing
+    # the file again
+    treated_df = run_script(emi_id_extracter)
+    run_script(create_directus_fields, treated_df)
+    run_script(db_updater, treated_df)
+    run_script(directus_link_maker)
+
+
+if __name__ == "__main__":
+    main()
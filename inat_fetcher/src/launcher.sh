@@ -3,40 +3,13 @@
 # To obtain the actual path to inat_fetcher dir
 p=$(dirname $(dirname $(realpath $0)))
 
-scripts_folder="/src/"
-path_to_scripts="${p}${scripts_folder}"
-
-# Create necessary directories if they don't exist
-mkdir -p "${p}/data"
-mkdir -p "${p}/data/in"
-mkdir -p "${p}/data/out"
-
-# Function to run a script and check its return code
-run_script() {
-    script_name=$1
-    echo "Running $script_name"
-    python3 "${path_to_scripts}${script_name}.py"
-    if [ $? -ne 0 ]; then
-        echo "$script_name failed"
-        exit 1
-    fi
-}
-
-# Run fetcher
-run_script "fetcher"
-
-# Uncomment the following lines to run the scripts as needed
-# Run location formatter
-# run_script "location_formatter"
-
-# Run emi id extracter
-run_script "emi_id_extracter"
-
-# Run create directus fields
-run_script "create_directus_fields"
-
-# Run db updater
-run_script "db_updater"
-
-# Run directus link maker
-run_script "directus_link_maker"
+# The pipeline is run as a module from the repository root, so that the scripts can import each other
+cd "$(dirname "${p}")" || exit 1
+
+# Run all the scripts in a single python process: fetcher, emi id extracter, create directus fields, db updater and
+# directus link maker. The location formatter is not part of the pipeline.
+python3 -m inat_fetcher.src.launcher
+if [ $? -ne 0 ]; then
+    echo "launcher failed"
+    exit 1
+fi
@@ -0,0 +1,35 @@
+import io
+
+import pandas as pd
+
+from inat_fetcher.src.create_directus_fields import merge_dtypes, scan_columns
+
+csv = """id,accuracy,description,mixed
+1,10,short,1
+2,12,a bit longer,2
+3,,the longest description of all,3
+4,8.5,tiny,four
+"""
+
+
+def test_merge_dtypes():
+    assert merge_dtypes("int64", "int64") == "int64"
+    assert merge_dtypes("int64", "float64") == "float64"
+    assert merge_dtypes("float64", "int64") == "float64"
+    assert merge_dtypes("int64", "object") == "object"
+    assert merge_dtypes("bool", "float64") == "object"
+
+
+def test_scan_columns_matches_a_single_read():
+    dtypes, longest_content = scan_columns(pd.read_csv(io.StringIO(csv), chunksize=2))
+
+    # The types merged across chunks are the ones pandas infers when reading the whole table at once
+    df = pd.read_csv(io.StringIO(csv))
+    assert dtypes == {col_name: str(dtype) for col_name, dtype in df.dtypes.items()}
+    assert longest_content == {"id": 0, "accuracy": 0, "description": 30, "mixed": 4}
+
+
+def test_scan_columns_of_a_single_dataframe():
+    df = pd.DataFrame({"id": [1, 2], "quality_grade": pd.array(["casual", "research"], dtype="string")})
+
+    assert scan_columns([df]) == ({"id": "int64", "quality_grade": "string"}, {"id": 0, "quality_grade": 8})
@@ -0,0 +1,144 @@
+import math
+
+import orjson
+import pandas as pd
+import requests
+from requests.adapters import BaseAdapter
+
+from inat_fetcher.src import db_updater
+from inat_fetcher.src.db_updater import format_observations, read_chunks, upload
+
+directus_api = "http://directus.test/items/Curation_Data/"
+
+
+class RejectingAdapter(BaseAdapter):
+    """Rejects every request holding the observation with the given id, as directus does for a whole batch."""
+
+    def __init__(self, rejected_id):
+        super().__init__()
+        self.rejected_id = rejected_id
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        body = orjson.loads(request.body)
+        observations = body if isinstance(body, list) else [body]
+        response = requests.Response()
+        response.status_code = 400 if any(item["id"] == self.rejected_id for item in observations) else 200
+        response._content = b"{}"
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def mount(monkeypatch, adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    monkeypatch.setattr(db_updater, "get_session", lambda: session)
+    monkeypatch.setattr(db_updater, "directus_api", directus_api)
+
+
+def test_format_observations_sends_missing_and_infinite_values_as_null():
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "positional_accuracy": [4.0, math.nan, math.inf],
+        "taxon.name": ["Quercus robur", None, "Fagus sylvatica"],
+    })
+
+    observations = orjson.loads(orjson.dumps(format_observations(df), option=orjson.OPT_SERIALIZE_NUMPY))
+
+    assert observations == [
+        {"id": 1, "positional_accuracy": 4.0, "taxon_name": "Quercus robur"},
+        {"id": 2, "positional_accuracy": None, "taxon_name": None},
+        {"id": 3, "positional_accuracy": None, "taxon_name": "Fagus sylvatica"},
+    ]
+
+
+def test_format_observations_formats_coordinates_as_geojson_points():
+    df = pd.DataFrame({"id": [1, 2], "geojson.coordinates": ["[6.5,46.5]", None]})
+
+    assert format_observations(df) == [
+        {"id": 1, "geojson_coordinates": '{"type":"Point","coordinates":[6.5,46.5]}'},
+        {"id": 2, "geojson_coordinates": None},
+    ]
+
+
+def test_format_observations_reads_na_coordinates_as_missing(monkeypatch, tmp_path):
+    # Coordinates written as NA in the treated CSV are read back as missing, and sent as null
+    path = tmp_path / "inat_observations_treated.csv"
+    path.write_text('id,geojson.coordinates\n1,NA\n2,"[6.5,46.5]"\n')
+    monkeypatch.setattr(db_updater, "path_to_output_file", path)
+
+    observations = [observation for chunk in read_chunks(None) for observation in format_observations(chunk)]
+
+    assert observations == [
+        {"id": 1, "geojson_coordinates": None},
+        {"id": 2, "geojson_coordinates": '{"type":"Point","coordinates":[6.5,46.5]}'},
+    ]
+
+
+def test_read_chunks_from_memory_matches_csv(monkeypatch, tmp_path):
+    df = pd.DataFrame({
+        "id": [1, 2, 3, 4, 5],
+        "uuid": ["a", "b", "c", "d", "e"],
+        "emi_external_id": pd.array(
+            ["dbgi_000001", "dbgi_000002", "dbgi_000003", "dbgi_000004", "dbgi_000005"], dtype="string"
+        ),
+        "geojson.coordinates": ["[6.5,46.5]", None, "[7.0,47.0]", "[7.5,47.5]", None],
+        "quality_grade": ["research", "casual", "needs_id", "research", "casual"],
+        "positional_accuracy": [4.0, None, 12.0, 3.0, 8.0],
+        "taxon.id": [10, 11, 12, 13, 14],
+    })
+    path = tmp_path / "inat_observations_treated.csv"
+    df.to_csv(path, index=False)
+    monkeypatch.setattr(db_updater, "path_to_output_file", path)
+    monkeypatch.setattr(db_updater, "chunk_size", 2)
+
+    from_csv = [format_observations(chunk) for chunk in read_chunks(None)]
+    from_memory = [format_observations(chunk) for chunk in read_chunks(df)]
+
+    assert len(from_memory) == 3
+    assert from_memory == from_csv
+
+
+def test_upload_sends_a_batch_in_a_single_request(monkeypatch):
+    adapter = RejectingAdapter(rejected_id=None)
+    mount(monkeypatch, adapter)
+
+    upload("POST", [{"id": 1, "emi_external_id": "dbgi_000001"}, {"id": 2, "emi_external_id": "dbgi_000002"}])
+
+    assert [(request.method, request.url) for request in adapter.requests] == [("POST", directus_api)]
+
+
+def test_upload_sends_a_rejected_batch_one_by_one(monkeypatch, capsys):
+    adapter = RejectingAdapter(rejected_id=2)
+    mount(monkeypatch, adapter)
+    batch = [{"id": observation_id, "emi_external_id": f"dbgi_00000{observation_id}"} for observation_id in (1, 2, 3)]
+
+    upload("PATCH", batch)
+
+    # Known observations are updated through their own url, and only the rejected one is reported
+    assert [(request.method, request.url) for request in adapter.requests] == [
+        ("PATCH", directus_api),
+        ("PATCH", f"{directus_api}1"),
+        ("PATCH", f"{directus_api}2"),
+        ("PATCH", f"{directus_api}3"),
+    ]
+    printed = capsys.readouterr().out
+    assert "dbgi_000002" in printed
+    assert "dbgi_000001" not in printed
+    assert "dbgi_000003" not in printed
+
+
+def test_upload_creates_the_observations_of_a_rejected_batch_one_by_one(monkeypatch):
+    adapter = RejectingAdapter(rejected_id=1)
+    mount(monkeypatch, adapter)
+
+    upload("POST", [{"id": 1, "emi_external_id": "dbgi_000001"}, {"id": 2, "emi_external_id": "dbgi_000002"}])
+
+    assert [(request.method, request.url, orjson.loads(request.body)) for request in adapter.requests[1:]] == [
+        ("POST", directus_api, {"id": 1, "emi_external_id": "dbgi_000001"}),
+        ("POST", directus_api, {"id": 2, "emi_external_id": "dbgi_000002"}),
+    ]
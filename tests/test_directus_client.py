@@ -0,0 +1,106 @@
+import functools
+import io
+import json
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from inat_fetcher.src import directus_client
+
+directus_login = "http://directus.test/auth/login"
+items_url = "http://directus.test/items/Field_Samples"
+
+
+class StubRaw(io.BytesIO):
+    """Response body recording whether its connection was released to the pool."""
+
+    released = False
+
+    def release_conn(self):
+        self.released = True
+
+
+class StubAdapter(BaseAdapter):
+    """Answers each url with the next of its given status codes and records the requests it receives."""
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = statuses
+        self.requests = []
+        self.responses = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status = self.statuses[request.url].pop(0)
+        body = {"data": {"access_token": "new", "expires": 900000}} if request.url == directus_login else {"data": []}
+        response = requests.Response()
+        response.status_code = status
+        response.raw = StubRaw(json.dumps(body).encode())
+        response.request = request
+        response.url = request.url
+        self.responses.append(response)
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch, tmp_path):
+    monkeypatch.setattr(directus_client, "directus_login", directus_login)
+    monkeypatch.setattr(directus_client, "token_cache_file", tmp_path / "directus_token.json")
+    session = requests.Session()
+    session.headers["Authorization"] = "Bearer old"
+    session.hooks["response"].append(functools.partial(directus_client.reauthenticate, session))
+    return session
+
+
+def mount(session, statuses):
+    adapter = StubAdapter(statuses)
+    session.mount("http://", adapter)
+    return adapter
+
+
+def login_count(adapter):
+    return sum(request.url == directus_login for request in adapter.requests)
+
+
+def test_reauthenticate_logs_in_once_and_resends(session):
+    adapter = mount(session, {items_url: [401, 200], directus_login: [200]})
+
+    response = session.get(items_url)
+
+    assert response.status_code == 200
+    assert login_count(adapter) == 1
+    assert adapter.requests[-1].headers["Authorization"] == "Bearer new"
+    assert session.headers["Authorization"] == "Bearer new"
+    # The refused response was read and its connection released before the request was resent
+    assert adapter.responses[0].raw.released
+
+
+def test_reauthenticate_reuses_a_token_renewed_by_another_worker(session):
+    adapter = mount(session, {items_url: [401, 200, 401, 200], directus_login: [200]})
+    session.get(items_url)
+
+    # A request sent with the old token before the renewal is resent with the new one without logging in again
+    response = session.get(items_url, headers={"Authorization": "Bearer old"})
+
+    assert response.status_code == 200
+    assert login_count(adapter) == 1
+    assert adapter.requests[-1].headers["Authorization"] == "Bearer new"
+
+
+def test_reauthenticate_raises_when_refused_again(session):
+    adapter = mount(session, {items_url: [401, 401], directus_login: [200]})
+
+    with pytest.raises(requests.HTTPError):
+        session.get(items_url)
+    assert login_count(adapter) == 1
+
+
+def test_reauthenticate_ignores_other_responses(session):
+    adapter = mount(session, {items_url: [400]})
+
+    assert session.get(items_url).status_code == 400
+    assert login_count(adapter) == 0
@@ -0,0 +1,112 @@
+import orjson
+import pytest
+import requests
+
+from inat_fetcher.src import directus_link_maker
+
+fields = [
+    {"field": "field_sample_id", "schema": {"is_primary_key": True}},
+    {"field": "inat_observation_id", "schema": {"is_primary_key": False}},
+    {"field": "notes", "schema": None},
+]
+
+
+class FieldsSession:
+    """Answers the request for the fields of the field samples with the given status and fields."""
+
+    def __init__(self, status_code=200, fields=fields):
+        self.status_code = status_code
+        self.fields = fields
+
+    def get(self, url, timeout=None):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = orjson.dumps({"data": self.fields})
+        response.url = url
+        return response
+
+
+class FieldSamples:
+    """Records the updates sent to the field samples, rejecting every one holding the given sample."""
+
+    def __init__(self, rejected_id=None):
+        self.rejected_id = rejected_id
+        self.updates = []
+
+    def update(self, updates):
+        self.updates.append(updates)
+        links = updates if isinstance(updates, list) else []
+        return not any(link["field_sample_id"] == self.rejected_id for link in links)
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    collections = {
+        "Inat_Data": [
+            {"id": 1, "emi_external_id": "dbgi_000001"},
+            {"id": 2, "emi_external_id": "dbgi_000002"},
+            {"id": 3, "emi_external_id": "dbgi_000003"},
+            {"id": 4, "emi_external_id": "dbgi_000004"},
+        ],
+        "Field_Samples": [
+            {"field_sample_id": "dbgi_000001", "inat_observation_id": None},
+            {"field_sample_id": "dbgi_000002", "inat_observation_id": None},
+            {"field_sample_id": "dbgi_000003", "inat_observation_id": None},
+            {"field_sample_id": "dbgi_000004", "inat_observation_id": None},
+        ],
+        "Qfield_Data": [
+            {"field_sample_name": "Mixte", "field_sample_id_pk": "dbgi_000004"},
+            {"field_sample_name": "Mixte", "field_sample_id_pk": "dbgi_000005"},
+            {"field_sample_name": "Feuille", "field_sample_id_pk": "dbgi_000001"},
+        ],
+    }
+    monkeypatch.setattr(
+        directus_link_maker, "fetch_items", lambda collection_name, fields=None: collections[collection_name]
+    )
+    monkeypatch.setattr(directus_link_maker, "get_session", FieldsSession)
+    return collections
+
+
+def mount(monkeypatch, field_samples):
+    monkeypatch.setattr(directus_link_maker, "update_field_samples", field_samples.update)
+
+
+def test_run_links_the_samples_and_marks_the_known_mixed_ones_absent(monkeypatch, collections):
+    field_samples = FieldSamples()
+    mount(monkeypatch, field_samples)
+
+    directus_link_maker.run()
+
+    links, absent = field_samples.updates
+    assert [link["field_sample_id"] for link in links] == ["dbgi_000001", "dbgi_000002", "dbgi_000003"]
+    # The mixed sample missing from the field samples is not sent
+    assert absent == {"keys": ["dbgi_000004"], "data": {"inat_observation_id": "absent", "inaturalist_link": "absent"}}
+
+
+def test_run_sends_the_links_of_a_rejected_batch_one_by_one(monkeypatch, collections, capsys):
+    field_samples = FieldSamples(rejected_id="dbgi_000002")
+    mount(monkeypatch, field_samples)
+
+    directus_link_maker.run()
+
+    # Only the rejected sample is left unlinked, and it is named
+    assert [[link["field_sample_id"] for link in links] for links in field_samples.updates[1:4]] == [
+        ["dbgi_000001"],
+        ["dbgi_000002"],
+        ["dbgi_000003"],
+    ]
+    assert "1 field samples could not be linked: ['dbgi_000002']" in capsys.readouterr().out
+
+
+def test_run_raises_when_the_fields_are_refused(monkeypatch, collections):
+    monkeypatch.setattr(directus_link_maker, "get_session", lambda: FieldsSession(status_code=403))
+
+    with pytest.raises(requests.HTTPError):
+        directus_link_maker.run()
+
+
+def test_run_raises_without_a_primary_key(monkeypatch, collections):
+    monkeypatch.setattr(directus_link_maker, "get_session", lambda: FieldsSession(fields=fields[1:]))
+
+    with pytest.raises(directus_link_maker.MissingPrimaryKeyError, match="Field_Samples"):
+        directus_link_maker.run()
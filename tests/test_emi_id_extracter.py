@@ -0,0 +1,77 @@
+import re
+
+import pandas as pd
+import requests
+
+from inat_fetcher.src import emi_id_extracter
+from inat_fetcher.src.create_directus_fields import scan_columns
+from inat_fetcher.src.emi_id_extracter import extract_emi_external_ids, split_observations
+
+pattern = re.compile("(dbgi|emi)_[0-9]{6}|dbgi_spl_[0-9]{6}")
+
+
+def test_extract_emi_external_ids():
+    df = pd.DataFrame({
+        "tags": ["['emi_external_id:dbgi_000001']", "[]", "[]", "['emi_000004']"],
+        "ofvs.15466": ["dbgi_999999", "dbgi_000002", None, None],
+    })
+
+    # The tag wins over the observation field value, and observations with neither get NA
+    assert extract_emi_external_ids(df).tolist() == ["dbgi_000001", "dbgi_000002", "NA", "emi_000004"]
+
+
+def test_extract_emi_external_ids_with_the_string_dtype():
+    df = pd.DataFrame({"tags": ["['dbgi_000001']", "[]"], "ofvs.15466": [None, None]})
+
+    assert extract_emi_external_ids(df).dtype == "string"
+
+
+def test_split_observations():
+    df = pd.DataFrame({
+        "id": [1, 2, 3, 4],
+        "emi_external_id": pd.array(["dbgi_spl_000001", "emi_000002", "NA", "unknown_000004"], dtype="string"),
+    })
+
+    matched, unmatched = split_observations(df, pattern)
+
+    # Sample ids written as dbgi_spl_ are stored as dbgi_
+    assert matched["id"].tolist() == [1, 2]
+    assert matched["emi_external_id"].tolist() == ["dbgi_000001", "emi_000002"]
+    assert unmatched["id"].tolist() == [3, 4]
+    assert unmatched["emi_external_id"].tolist() == ["NA", "unknown_000004"]
+    # The given DataFrame is left untouched
+    assert df["emi_external_id"].tolist()[0] == "dbgi_spl_000001"
+
+
+class ProjectsSession:
+    """Answers the request for the projects codes with a single dbgi project."""
+
+    def get(self, url, params=None):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"data": [{"project_id": "dbgi"}]}'
+        return response
+
+
+def test_run_hands_over_the_types_of_the_treated_csv(monkeypatch, tmp_path):
+    # taxon.is_active is set on every matched observation and empty on the unmatched one, and sample_count only holds
+    # numbers on the matched ones
+    path_to_input_file = tmp_path / "inat_observations_raw.csv"
+    path_to_input_file.write_text(
+        "id,tags,ofvs.15466,taxon.is_active,sample_count\n"
+        "1,['dbgi_000001'],,True,1\n"
+        "2,[],dbgi_000002,True,2\n"
+        "3,[],,,unknown\n"
+    )
+    monkeypatch.setattr(emi_id_extracter, "get_session", ProjectsSession)
+    monkeypatch.setattr(emi_id_extracter, "path_to_input_file", path_to_input_file)
+    monkeypatch.setattr(emi_id_extracter, "path_to_output_file", tmp_path / "inat_observations_treated.csv")
+    monkeypatch.setattr(emi_id_extracter, "path_to_recovery_file", tmp_path / "inat_observation_recovery.csv")
+
+    treated_df = emi_id_extracter.run()
+
+    # The fields created from the observations handed over in memory are the ones created from the treated CSV
+    dtypes, _ = scan_columns([treated_df])
+    assert dtypes == scan_columns(pd.read_csv(tmp_path / "inat_observations_treated.csv", chunksize=1))[0]
+    assert dtypes["taxon.is_active"] == "bool"
+    assert dtypes["sample_count"] == "int64"